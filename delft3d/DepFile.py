@@ -1,10 +1,41 @@
-import re
+import copy
+import os
+from functools import lru_cache
+
+import matplotlib
 import numpy as np
-from delft3d.GrdFile import GrdFile
+from delft3d.GrdFile import GrdFile, _parse_numbers, _invalid_cells, _fill_missing
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from matplotlib.colors import ListedColormap
 
+# colormap of depth, built once at import
+try:
+    _BLUES = matplotlib.colormaps['Blues'].resampled(12)
+except AttributeError:
+    # matplotlib < 3.6
+    _BLUES = cm.get_cmap('Blues', 12)
+_DEPTH_CMAP = ListedColormap(_BLUES(np.linspace(0.2, 1, 256)))
+
+
+@lru_cache(maxsize=8)
+def _load_grd(filename, mtime, size):
+    """Read grd file. Cached by filename, modification time and size to avoid parsing the same grid again"""
+    return GrdFile(filename)
+
+
+def _is_rectilinear(x, y):
+    """Whether the grid is axis-aligned with uniform spacing, so that it can be drawn as an image"""
+    if x.shape[0] < 2 or x.shape[1] < 2:
+        return False
+    dx, dy = np.diff(x[0]), np.diff(y[:, 0])
+    if dx[0] == 0 or dy[0] == 0:
+        return False
+    # the tolerance is relative to the cell size, not to the (large) projected coordinates
+    tol = dict(rtol=0, atol=1e-6 * min(abs(dx[0]), abs(dy[0])))
+    return (np.allclose(x, x[:1], **tol) and np.allclose(y, y[:, :1], **tol) and
+            np.allclose(dx, dx[0], **tol) and np.allclose(dy, dy[0], **tol))
+
 
 class DepFile(object):
     """
@@ -16,12 +47,18 @@ class DepFile(object):
     >>> dep1 = delft3d.DepFile('example/example1.dep', 'example/example1.grd')
     >>> grd_file = delft3d.GrdFile('example/example1.grd')
     >>> dep2 = delft3d.DepFile('example/example1.dep', grd_file)
+    >>> dep3 = delft3d.DepFile('example/example1.dep', grd_file, dtype=np.float32)
     """
-    def __init__(self, filename, grd_file):
+    def __init__(self, filename, grd_file, dtype=np.float64):
         self.filename = filename
-        if type(grd_file) == str:
-            self.grd_file = GrdFile(grd_file)
-        elif type(grd_file) == GrdFile:
+        # float32 halves the memory, but the last digit written by export may differ from the file
+        self.dtype = dtype
+        if isinstance(grd_file, str):
+            # the cached grid is shared, so work on a copy of it
+            grd = _load_grd(os.path.abspath(grd_file), os.path.getmtime(grd_file), os.path.getsize(grd_file))
+            self.grd_file = copy.deepcopy(grd)
+            self.grd_file.filename = grd_file
+        elif isinstance(grd_file, GrdFile):
             self.grd_file = grd_file
         else:
             raise ValueError("Please supply the GrdFile instance or grd file's filename")
@@ -29,18 +66,14 @@ class DepFile(object):
 
     def load_dep(self):
         """Read dep file"""
-        with open(self.filename, 'r') as f:
+        # dep file is plain ASCII numbers, read it as bytes and let numpy parse it directly
+        with open(self.filename, 'rb', buffering=1 << 20) as f:
             data = f.read()
-        pattern = r'(\s+[\d.E+-]+\n?){' + str(self.grd_file.header['MN'][0] + 1) + '}'
-        matches = re.finditer(pattern, data)
-        dep = list()
-        for matche in matches:
-            dep.append([float(i) for i in matche[0].split()])
-        dep = np.array(dep)
-        dep = np.delete(dep, -1, axis=0)
-        dep = np.delete(dep, -1, axis=1)
-
-        return dep
+        # parse all numbers in one pass, each row has M+1 values (wrapped over several lines)
+        m, n = self.grd_file.header['MN']
+        dep = _parse_numbers(data, (m + 1) * (n + 1), self.dtype)
+        # drop the dummy last row and column
+        return dep.reshape(n + 1, m + 1)[:-1, :-1]
 
     def plot(self, filename=None, sph_epsg=4326, car_epsg=3857):
         """
@@ -72,40 +105,34 @@ class DepFile(object):
             print("Automatically transform from spherical to cartesian coordinates")
 
         # Prepossessing
-        x, y = np.array(self.grd_file.x), np.array(self.grd_file.y)
+        # the grid is only read, _fill_missing returns new arrays when it fills something
+        x, y = self.grd_file.x, self.grd_file.y
         z = self.data.copy()  # generate z for pcolormesh
         # if any of the four corners of each grid is invalid(missing value), the grid is marked invalid
         # this prepossess make sure that pcolormesh won't generate weired grid because of missing value
-        for i in range(x.shape[0] - 1):
-            for j in range(x.shape[1] - 1):
-                if x[i, j] == 0 or x[i+1, j] == 0 or x[i, j+1] == 0 or x[i+1, j+1] == 0:
-                    z[i, j] = -999
+        z[:-1, :-1][_invalid_cells(x, 0)] = -999
         # mask the invalid grid to make it transparent in pcolormesh
         z = np.ma.masked_equal(z, -999)
 
         # interpolate the missing value in grd file
         # otherwise the pcolormesh will include the missing value in grid
         missing_value = self.grd_file.header['Missing Value']
-        for index, arr in enumerate(x):
-            x1 = np.argwhere(arr == missing_value).ravel()
-            x2 = np.argwhere(arr != missing_value).ravel()
-            y2 = arr[arr != missing_value]
-            x[index][x[index] == missing_value] = np.interp(x1, x2, y2)
-        for index, arr in enumerate(y):
-            x1 = np.argwhere(arr == missing_value).ravel()
-            x2 = np.argwhere(arr != missing_value).ravel()
-            y2 = arr[arr != missing_value]
-            y[index][y[index] == missing_value] = np.interp(x1, x2, y2)
-
-        # Define colormap
-        blues = cm.get_cmap('Blues', 12)
-        newcolors = blues(np.linspace(0.2, 1, 256))
-        newcmp = ListedColormap(newcolors)
+        x = _fill_missing(x, missing_value)
+        y = _fill_missing(y, missing_value)
+
         # plot depth
         fig = plt.figure(figsize=(10, 8))
         ax = fig.add_subplot(111)
-        ax0 = ax.pcolormesh(x, y, z, cmap=newcmp,
-                            linewidth=0.005, edgecolor=None)
+        # each cell is bounded by four grid points, so the last row and column of z are not drawn
+        if _is_rectilinear(x, y):
+            # a regular grid is drawn as one image, which is much faster than drawing every cell
+            image = z[:-1, :-1]
+            image = image[:, ::-1] if x[0, -1] < x[0, 0] else image
+            image = image[::-1] if y[-1, 0] < y[0, 0] else image
+            ax0 = ax.imshow(image, cmap=_DEPTH_CMAP, origin='lower', interpolation='nearest',
+                            extent=[x.min(), x.max(), y.min(), y.max()])
+        else:
+            ax0 = ax.pcolormesh(x, y, z[:-1, :-1], cmap=_DEPTH_CMAP, shading='flat')
         ax.axis('equal')
         fig.colorbar(ax0)
         if filename:
@@ -142,38 +169,20 @@ class DepFile(object):
              '  -5.0850775E-02   3.1147481E-01   4.6392793E-01\\n,
              ...]
         """
-        dep_data = np.append(self.data, np.full((1, self.data.shape[1]), -999.0), axis=0)
-        dep_data = np.append(dep_data, np.full((dep_data.shape[0], 1), -999.0), axis=1)
-
-        dep_file = []
-        for index, depth in enumerate(dep_data):
-            line = ""
-            counts = 0
-            for num in depth:
-                if counts == 0:
-                    line += "%16.7E" % num
-                elif counts % 12 == 11:
-                    line += "%16.7E\n" % num
-                elif counts % 12 == 0:
-                    line += "%16.7E" % num
-                else:
-                    line += "%16.7E" % num
-                if counts == len(depth) - 1 and counts % 12 != 11:
-                    line += '\n'
-                counts += 1
-            # grd_file.append(line)
-            line = line.splitlines()
-            line = [x + '\n' for x in line]
-            dep_file.extend(line)
-
-        # dep_file = []
-        # for line in list(dep_data):
-        #     temp = []
-        #     for num in line:
-        #         temp.append("%16.7E" % num)
-        #     temp = ''.join(temp) + '\n'
-        #     dep_file.append(temp)
-        return dep_file
+        return list(self._iter_lines())
+
+    def _iter_lines(self):
+        """Generate the lines of Delft3D dep file one by one. Used by self.export and self.to_file"""
+        # the dummy last column and last row are filled with -999, format them only once
+        dummy = "%16.7E" % -999.0
+        dummy_row = [dummy] * (self.data.shape[1] + 1)
+        # format a row at once, then wrap it into lines of at most 12 numbers
+        for row in self.data:
+            row = np.char.mod('%16.7E', row).tolist() + [dummy]
+            for i in range(0, len(row), 12):
+                yield ''.join(row[i:i + 12]) + '\n'
+        for i in range(0, len(dummy_row), 12):
+            yield ''.join(dummy_row[i:i + 12]) + '\n'
 
     def to_file(self, filename):
         """
@@ -189,6 +198,5 @@ class DepFile(object):
         >>> dep = delft3d.DepFile('example/example1.dep', 'example/example1.grd')
         >>> dep.to_file('example1.dep')
         """
-        dep_file = self.export()
         with open(filename, 'w') as f:
-            f.writelines(dep_file)
+            f.writelines(self._iter_lines())
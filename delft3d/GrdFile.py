@@ -1,9 +1,99 @@
+import locale
+import mmap
 import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import matplotlib.pyplot as plt
 import numpy as np
 from pyproj import CRS, Transformer
 
+_COORDINATE_SYSTEM_RE = re.compile(r'Coordinate System = ([\w]+)')
+_MISSING_VALUE_RE = re.compile(r'Missing Value\s+=\s+([\w+-.]+)')
+_MN_RE = re.compile(r'\n\s+([\d]+)\s+([\d]+)\n')
+_ETA_RE = re.compile(rb' ETA=\s*\d+')
+
+
+@lru_cache(maxsize=32)
+def _get_transformer(init_epsg, obj_epsg):
+    """
+    Create the Transformer between two EPSG coordinate systems, cached for reuse.
+    always_xy keeps the order of grd files, x is longitude and y is latitude
+    """
+    return Transformer.from_crs(CRS.from_epsg(init_epsg), CRS.from_epsg(obj_epsg), always_xy=True)
+
+
+def _transform(init_epsg, obj_epsg, x, y):
+    """
+    Transform coordinates with the cached Transformer, as contiguous float64 arrays.
+    x and y are always longitude/easting and latitude/northing, whatever the axis order of the EPSG
+    """
+    return _get_transformer(init_epsg, obj_epsg).transform(
+        np.ascontiguousarray(x, dtype=np.float64), np.ascontiguousarray(y, dtype=np.float64))
+
+
+def _fromstring(data, dtype=np.float64):
+    """
+    Parse whitespace separated numbers in one pass of numpy's C parser. numpy stops at the first
+    malformed number with a DeprecationWarning (a ValueError in later versions), raise our own
+    ValueError instead.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(data, sep=' ', dtype=dtype)
+        except (DeprecationWarning, ValueError):
+            pass
+    # only reached for a malformed file, find the first malformed number for the error message
+    for index, value in enumerate(data.split()):
+        try:
+            float(value)
+        except ValueError:
+            value = value.decode(errors='replace') if isinstance(value, bytes) else value
+            raise ValueError("Found invalid value '%s' after %d values" % (value, index)) from None
+    raise ValueError("Found invalid values")
+
+
+def _parse_numbers(data, count, dtype=np.float64):
+    """
+    Parse whitespace separated numbers in one pass of numpy's C parser
+    and make sure that exactly the expected number of values is read.
+    """
+    numbers = _fromstring(data, dtype)
+    if numbers.size != count:
+        raise ValueError("Found %d values, but %d values are required by the grid"
+                         % (numbers.size, count))
+    return numbers
+
+
+def _invalid_cells(x, invalid):
+    """Mark the cells that have at least one corner equal to the invalid value"""
+    corner = x == invalid
+    return corner[:-1, :-1] | corner[1:, :-1] | corner[:-1, 1:] | corner[1:, 1:]
+
+
+def _fill_missing(x, missing_value):
+    """
+    Linearly interpolate the missing values of each row from the valid values
+    of the same row, which is the same as calling np.interp row by row.
+    """
+    valid = x != missing_value
+    if valid.all():
+        return x
+    rows = np.arange(x.shape[0])[:, None]
+    cols = np.arange(x.shape[1])
+    # column of the previous and the next valid value in the same row
+    prev = np.maximum.accumulate(np.where(valid, cols, -1), axis=1)
+    nxt = np.minimum.accumulate(np.where(valid, cols, x.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    # missing values before the first or after the last valid value take the nearest valid value
+    lo = np.clip(np.where(prev < 0, nxt, prev), 0, x.shape[1] - 1)
+    hi = np.clip(np.where(nxt == x.shape[1], prev, nxt), 0, x.shape[1] - 1)
+    x_lo, x_hi = x[rows, lo], x[rows, hi]
+    span = hi - lo
+    slope = np.divide(x_hi - x_lo, span, out=np.zeros(x.shape), where=span > 0)
+    return np.where(valid, x, slope * (cols - lo) + x_lo)
+
 
 class GrdFile(object):
     """
@@ -19,35 +109,61 @@ class GrdFile(object):
         self.filename = filename
         self.x, self.y = None, None
         self.header = {}
+        self._cartesian = None  # cached projection of a spherical grid, see self._cartesian_xy
         self.load_file()
 
+    @classmethod
+    def load_many(cls, filenames, workers=None):
+        """
+        Read many grd files at once. The files are read by a pool of threads,
+        so that reading one file overlaps with parsing another one.
+
+        Parameters
+        ----------
+        filenames : list or tuple
+            Filenames of the grd files.
+        workers : int, optional
+            Number of threads. By default it is decided by ThreadPoolExecutor.
+
+        Returns
+        -------
+        grds : list
+            GrdFile instances in the same order as filenames.
+
+        Examples
+        --------
+        >>> import delft3d
+        >>> grds = delft3d.GrdFile.load_many(['example/example1.grd', 'example/example2.grd'])
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(cls, filenames))
+
     def load_file(self):
-        """Read dep file"""
-        with open(self.filename, 'r') as f:
-            data = f.read()
+        """Read grd file"""
+        # map the file instead of reading it, and work on the raw bytes without decoding them
+        with open(self.filename, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, memoryview(data) as view:
+            # the coordinate block starts at the first row label, everything before it is header
+            body_start = data.find(b' ETA=')
+            if body_start == -1:
+                raise ValueError("No grid coordinates found in %s" % self.filename)
+            # decode and translate newlines of the header the same way as text mode
+            header = data[:body_start].decode(locale.getpreferredencoding(False))
+            header = header.replace('\r\n', '\n').replace('\r', '\n')
+            # read coordinates: strip the row labels and parse all numbers at once
+            coordinates = _ETA_RE.sub(b'', view[body_start:])
         # read headers
-        coordinate_system = re.search(r'Coordinate System = ([\w]+)', data)
+        coordinate_system = _COORDINATE_SYSTEM_RE.search(header)
         self.header['Coordinate System'] = coordinate_system.group(1) if coordinate_system else None
-        missing_value = re.search(r'Missing Value\s+=\s+([\w+-.]+)', data)
-        self.header['Missing Value'] = np.float(missing_value.group(1)) if missing_value else 0
-        mn = re.search(r'\n\s+([\d]+)\s+([\d]+)\n', data)
+        missing_value = _MISSING_VALUE_RE.search(header)
+        self.header['Missing Value'] = float(missing_value.group(1)) if missing_value else 0
+        mn = _MN_RE.search(header)
         m, n = int(mn.group(1)), int(mn.group(2))
         self.header['MN'] = [m, n]
-        # read coordinates
-        x, y = [], []
-        pattern = r' ETA=\s+\d+(\s+[\d.Ee+-]+\n?){' + str(m) + '}'
-        matches = re.finditer(pattern, data)
-        for index, match in enumerate(matches):
-            cor = match[0].split()[2:]
-            cor = [np.float(num) for num in cor]
-            if index < n:
-                x.extend(cor)
-            else:
-                y.extend(cor)
-        x, y = np.array(x), np.array(y)
-        # reshape to the original format
-        self.x = x.reshape(n, m)
-        self.y = y.reshape(n, m)
+        coordinates = _parse_numbers(coordinates, 2 * n * m)
+        # the first half is x and the second half is y. Both are views of the parsed array,
+        # so the coordinates are stored in one allocation and never copied row by row
+        self.x, self.y = coordinates.reshape(2, n, m)
 
     def spherical_to_cartesian(self, sph_epsg=4326, car_epsg=3857):
         """
@@ -75,11 +191,9 @@ class GrdFile(object):
             pass
         else:
             # transform from spherical to cartesian
-            init_crs = CRS.from_epsg(sph_epsg)
-            obj_crs = CRS.from_epsg(car_epsg)
-            projection = Transformer.from_crs(init_crs, obj_crs)
             # update x, y
-            self.x, self.y = projection.transform(self.x, self.y)
+            self.x, self.y = _transform(sph_epsg, car_epsg, self.x, self.y)
+            self._cartesian = None
             # update header
             self.header['Coordinate System'] = 'Cartesian'
 
@@ -109,14 +223,22 @@ class GrdFile(object):
             pass
         else:
             # transform from cartesian to spherical
-            init_crs = CRS.from_epsg(car_epsg)
-            obj_crs = CRS.from_epsg(sph_epsg)
-            projection = Transformer.from_crs(init_crs, obj_crs)
             # update x, y
-            self.x, self.y = projection.transform(self.x, self.y)
+            self.x, self.y = _transform(car_epsg, sph_epsg, self.x, self.y)
+            self._cartesian = None
             # update header
             self.header['Coordinate System'] = 'Spherical'
 
+    def _cartesian_xy(self, sph_epsg, car_epsg):
+        """
+        Project the spherical grid to cartesian coordinates without modifying the grid.
+        The result is cached until the grid changes, so repeated queries only project once.
+        """
+        if self._cartesian is None or self._cartesian[0] != (sph_epsg, car_epsg):
+            grd_x, grd_y = _transform(sph_epsg, car_epsg, self.x, self.y)
+            self._cartesian = ((sph_epsg, car_epsg), grd_x, grd_y)
+        return self._cartesian[1], self._cartesian[2]
+
     def get_nearest_grid(self, x, y, sph_epsg=4326, car_epsg=3857):
         """
         Find the nearest grid for the giving coordinate. If the coordinate system is
@@ -127,10 +249,10 @@ class GrdFile(object):
 
         Parameters
         ----------
-        x : float
-            x coordinate.
-        y : float
-            y coordinate.
+        x : float or array_like
+            x coordinate. Give an array to query many points at once.
+        y : float or array_like
+            y coordinate. Same shape as x.
         sph_epsg : int, optional
             The EPSG of spherical cooridante.
         car_epsg : int, optional
@@ -138,7 +260,7 @@ class GrdFile(object):
         Returns
         -------
         m, n : tuple
-            (m,n) coordinate of grid
+            (m,n) coordinate of grid. Arrays with the same shape as x if x is an array.
 
         Examples
         --------
@@ -146,22 +268,36 @@ class GrdFile(object):
         >>> grd = delft3d.GrdFile('example/example1.grd')
         >>> m1, n1 = grd.get_nearest_grid(505944.89, 2497013.47)
         >>> m2, n2 = grd.get_nearest_grid(505944.89, 2497013.47, sph_epsg=4326, car_epsg=26917)
+        >>> ms, ns = grd.get_nearest_grid([505944.89, 506120.37], [2497013.47, 2497251.06])
         """
         if self.header['Coordinate System'] == 'Spherical':
             # transform from spherical to cartesian
-            grd_crs = CRS.from_epsg(sph_epsg)
-            plot_crs = CRS.from_epsg(car_epsg)
-            projection = Transformer.from_crs(grd_crs, plot_crs)
-            grd_x, grd_y = projection.transform(self.x, self.y)
+            grd_x, grd_y = self._cartesian_xy(sph_epsg, car_epsg)
             print("Automatically transform from spherical to cartesian coordinates.\n"
                   "Change the default projection by giving specific grd_epsg and plot_epsg")
         else:
             grd_x, grd_y = self.x, self.y
-        # calculate distance
-        dis = np.sqrt(
-            (x - grd_x.ravel()) ** 2 + (y - grd_y.ravel()) ** 2)
-        # find nearest grid
-        num = np.argmin(dis)
+        grd_x, grd_y = grd_x.ravel(), grd_y.ravel()
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        if x.shape != y.shape:
+            raise ValueError("x and y must have the same shape, but got %s and %s" % (x.shape, y.shape))
+        points_x, points_y = x.ravel(), y.ravel()
+        num = np.empty(points_x.size, dtype=np.intp)
+        # query the points block by block to keep the distance matrix small. The buffers of
+        # the distance matrix are allocated once and reused by every block
+        block = max(1, min(2 ** 20 // grd_x.size, points_x.size))
+        dis2, dy2 = np.empty((block, grd_x.size)), np.empty((block, grd_x.size))
+        for start in range(0, points_x.size, block):
+            k = min(block, points_x.size - start)
+            # calculate squared distance in place, sqrt is not needed for finding the minimum
+            np.subtract(grd_x, points_x[start:start + k, None], out=dis2[:k])
+            np.square(dis2[:k], out=dis2[:k])
+            np.subtract(grd_y, points_y[start:start + k, None], out=dy2[:k])
+            np.square(dy2[:k], out=dy2[:k])
+            np.add(dis2[:k], dy2[:k], out=dis2[:k])
+            # find nearest grid
+            num[start:start + k] = np.argmin(dis2[:k], axis=1)
+        num = num[0] if x.ndim == 0 else num.reshape(x.shape)
         n, m = np.unravel_index(num, (self.header['MN'][1], self.header['MN'][0]))
         return m, n
 
@@ -191,43 +327,27 @@ class GrdFile(object):
         """
         if self.header['Coordinate System'] == 'Spherical':
             # transform from spherical to cartesian
-            grd_crs = CRS.from_epsg(sph_epsg)
-            plot_crs = CRS.from_epsg(car_epsg)
-            projection = Transformer.from_crs(grd_crs, plot_crs)
-            x, y = projection.transform(self.x, self.y)
-
+            x, y = self._cartesian_xy(sph_epsg, car_epsg)
             print("Automatically transform from spherical to cartesian coordinates.\n"
                   "Change the default projection by giving specific grd_epsg and plot_epsg")
         else:
             x, y = self.x, self.y
 
-        x, y = x.copy(), y.copy()
-        # Prepossessing
+        # Prepossessing. x and y are only read, _fill_missing returns new arrays
+        # when it fills something, so the grid itself is not copied
         z = np.zeros(np.shape(x))  # generate z for pcolormesh
         # If any of the four corners of each grid is invalid(missing value),
         # the grid is marked invalid. This prepossess make sure that pcolormesh
         # won't generate weired grid because of the missing value
         invlid = self.header['Missing Value']  # Missing Value
-        for i in range(x.shape[0] - 1):
-            for j in range(x.shape[1] - 1):
-                if x[i, j] == invlid or x[i + 1, j] == invlid or \
-                        x[i, j + 1] == invlid or x[i + 1, j + 1] == invlid:
-                    z[i, j] = 1
+        z[:-1, :-1][_invalid_cells(x, invlid)] = 1
         # mask the invalid grid to make it transparent in pcolormesh
         z = np.ma.masked_equal(z, 1)
 
         # interpolate the missing value in grd file
         # otherwise the pcolormesh will include the missing value in grid
-        for index, arr in enumerate(x):
-            x1 = np.argwhere(arr == invlid).ravel()
-            x2 = np.argwhere(arr != invlid).ravel()
-            y2 = arr[arr != invlid]
-            x[index][x[index] == invlid] = np.interp(x1, x2, y2)
-        for index, arr in enumerate(y):
-            x1 = np.argwhere(arr == invlid).ravel()
-            x2 = np.argwhere(arr != invlid).ravel()
-            y2 = arr[arr != invlid]
-            y[index][y[index] == invlid] = np.interp(x1, x2, y2)
+        x = _fill_missing(x, invlid)
+        y = _fill_missing(y, invlid)
         # plot grid
         fig = plt.figure(figsize=(10, 8))
         ax = fig.add_subplot(111)
@@ -261,6 +381,7 @@ class GrdFile(object):
         """
         self.x = x
         self.y = y
+        self._cartesian = None
         self.header['Coordinate System'] = coordinate_system
         self.header['MN'] = [x.shape[1], x.shape[0]]
 
@@ -297,25 +418,13 @@ class GrdFile(object):
     def grid_writer(grd_file, coordinates):
         """Helper function of self.export. Formatting grid data as Delft3D grd file"""
         grd_file = grd_file.copy()
-        for index, cor in enumerate(coordinates):
-            line = " ETA=%5d" % (index + 1)
-            counts = 0
-            for num in cor:
-                if counts == 0:
-                    line += "   %.17E" % num
-                elif counts % 5 == 4:
-                    line += "   %.17E\n" % num
-                elif counts % 5 == 0:
-                    line += "             %.17E" % num
-                else:
-                    line += "   %.17E" % num
-                if counts == len(cor) - 1 and counts % 5 != 4:
-                    line += '\n'
-                counts += 1
-            # grd_file.append(line)
-            line = line.splitlines()
-            line = [x + '\n' for x in line]
-            grd_file.extend(line)
+        # format all numbers at once, then wrap each row into lines of at most 5 numbers
+        cor_str = np.char.mod('%.17E', coordinates)
+        continuation = " " * 13
+        for index, cor in enumerate(cor_str):
+            lines = ['   '.join(cor[i:i + 5]) + '\n' for i in range(0, len(cor), 5)]
+            grd_file.append(" ETA=%5d   " % (index + 1) + lines[0])
+            grd_file.extend(continuation + line for line in lines[1:])
 
         return grd_file
 
@@ -334,6 +443,6 @@ class GrdFile(object):
         >>> grd = delft3d.GrdFile('example/example1.grd')
         >>> grd.to_file('example1.grd')
         """
-        grd_file = self.export()
-        with open(filename, 'w') as f:
-            f.writelines(grd_file)
+        grd_file = ''.join(self.export())
+        with open(filename, 'w', buffering=1 << 20) as f:
+            f.write(grd_file)
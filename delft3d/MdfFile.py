@@ -1,7 +1,53 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
+# name and value of a parameter, e.g. "Dt     = 1.0000000e+00"
+_PARM_RE = re.compile(r'([\w]+)\s*=\s*([\w .#+-:\[\]]*)$')
+# value of the following lines of a multiple-line parameter
+_MULTI_LINE_RE = re.compile(r'\s+(.*)$')
+# integer parameters
+_INT_KEYS = frozenset(['MNKmax', 'Ktemp', 'Ivapop', 'Irov', 'Iter'])
+
+
+def _format_array(key, content):
+    """Format array parameter"""
+    is_int = key in _INT_KEYS
+    if len(content.shape) > 1:
+        # multiple-line array parameter
+        formatter = "          %d\n" if is_int else "          %.7e\n"
+        first_line = ("%-6s = %d\n" if is_int else "%-6s = %.7e\n") % (key, content[0])
+        return [first_line] + [formatter % arr for arr in content[1:]]
+    elif len(content.shape) == 1:
+        # single-line array parameter
+        formatter = " %d" if is_int else " %.7e"
+        return ["%-6s =" % key + ''.join([formatter % arr for arr in content]) + '\n']
+    raise ValueError("invalid key")
+
+
+def _format_list(key, content):
+    """Format multiple-line character parameter"""
+    return ["%-6s = #%s#\n" % (key, content[0])] + ["         #%s#\n" % line for line in content[1:]]
+
+
+def _format_float(key, content):
+    """Format single number parameter"""
+    return [("%-6s = %d\n" if key in _INT_KEYS else "%-6s = %.7e\n") % (key, content)]
+
+
+def _format_str(key, content):
+    """Format single character parameter"""
+    if '[' not in content:
+        # single character parameter 1
+        return ["%-6s = #%s#\n" % (key, content)]
+    # single character parameter 2
+    return ["%-6s = %s\n" % (key, content)]
+
+
+# formatter of each type of parameter used by MdfFile.export
+_FORMATTERS = {np.ndarray: _format_array, list: _format_list, float: _format_float, str: _format_str}
+
 
 class MdfFile(object):
     """
@@ -16,6 +62,32 @@ class MdfFile(object):
         self.filename = filename
         self.data = self.load_file()
 
+    @classmethod
+    def load_many(cls, filenames, workers=None):
+        """
+        Read many mdf files at once. The files are read by a pool of threads,
+        so that reading one file overlaps with parsing another one.
+
+        Parameters
+        ----------
+        filenames : list or tuple
+            Filenames of the mdf files.
+        workers : int, optional
+            Number of threads. By default it is decided by ThreadPoolExecutor.
+
+        Returns
+        -------
+        mdfs : list
+            MdfFile instances in the same order as filenames.
+
+        Examples
+        --------
+        >>> import delft3d
+        >>> mdfs = delft3d.MdfFile.load_many(['example/example1.mdf', 'example/example2.mdf'])
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(cls, filenames))
+
     def load_file(self):
         """Read mdf file and store it in self.data as a dict"""
         with open(self.filename, 'r') as f:
@@ -23,9 +95,10 @@ class MdfFile(object):
         # read MDF File and store it in a dict
         mdf_dict = {}
         parm_name = None  # name of the parameter
+        multi_line_arrays = {}  # values of multiple-line array parameters
         for line in mdf_data:
             # search for the name and value of parameters
-            matches = re.search(r'^([\w]+)\s*=\s*([\w .#+-:\[\]]*)$', line)
+            matches = _PARM_RE.match(line)
             if matches is not None and matches[1] != 'Commnt':
                 # single-line parameter
                 # ignore the Comment which are unused by the model
@@ -44,18 +117,22 @@ class MdfFile(object):
                     mdf_dict[matches[1]] = np.array(num) if len(num) > 1 else num[0]
             elif matches is None:
                 # multiple-line parameter
-                matches = re.search(r'^\s+(.*)$', line)  # search for the value
+                matches = _MULTI_LINE_RE.match(line)  # search for the value
                 parm = mdf_dict.get(parm_name)  # find the name in the last recorded parameter
                 if '#' in line:
                     # multiple-line character parameter
-                    parm = parm if type(parm) == list else [parm]
+                    parm = parm if isinstance(parm, list) else [parm]
                     parm.append(matches[1].replace('#', ''))
+                    # store multiple-line parameter
+                    mdf_dict[parm_name] = parm
                 else:
-                    # multiple-line array parameter
-                    parm = np.array(parm).reshape(-1, 1)
-                    parm = np.append(parm, np.array(float(matches[1])).reshape(1, 1), axis=0)
-                # store multiple-line parameter
-                mdf_dict[parm_name] = parm
+                    # multiple-line array parameter, collect the values and convert them once at the end
+                    if parm_name not in multi_line_arrays:
+                        multi_line_arrays[parm_name] = list(np.ravel(parm))
+                    multi_line_arrays[parm_name].append(float(matches[1]))
+
+        for parm_name, values in multi_line_arrays.items():
+            mdf_dict[parm_name] = np.array(values).reshape(-1, 1)
 
         return mdf_dict
 
@@ -79,10 +156,10 @@ class MdfFile(object):
 
         """
         for key, value in data.items():
-            if type(self.data[key]) in [float, int]:
+            if isinstance(self.data[key], (float, int)):
                 # single number parameter
                 self.data[key] = float(value)
-            elif type(self.data[key]) == np.ndarray:
+            elif isinstance(self.data[key], np.ndarray):
                 # array parameter
                 if len(self.data[key].shape) == 1:
                     # single-line array parameter
@@ -116,10 +193,10 @@ class MdfFile(object):
         >>> mdf.add_parm({'FlNcdf': 'map his dro fou'})
         """
         for key, value in data.items():
-            if type(value) in [float, int]:
+            if isinstance(value, (float, int)):
                 # single number parameter
                 self.data[key] = float(value)
-            elif type(value) == np.ndarray:
+            elif isinstance(value, np.ndarray):
                 # array parameter
                 if len(value.shape) == 1:
                     # single-line array parameter
@@ -151,43 +228,12 @@ class MdfFile(object):
              ...]
         """
         mdf_file = []
-        int_key = ['MNKmax', 'Ktemp', 'Ivapop', 'Irov', 'Iter']  # integer parameters
         for key, content in self.data.items():
-            if type(content) == np.ndarray and len(content.shape) > 1:
-                # multiple-line array parameter
-                formatter = "%-6s = %d\n" if key in int_key else "%-6s = %.7e\n"
-                mdf_file.append(formatter % (key, content[0]))  # first line
-                for arr in content[1:]:  # the rest lines
-                    formatter = "          %d\n" if key in int_key else "          %.7e\n"
-                    mdf_file.append(formatter % arr)
-
-            elif type(content) == np.ndarray and len(content.shape) == 1:
-                # array parameter
-                line = "%-6s =" % key
-                for arr in content:
-                    line += " %d" % arr if key in int_key else " %.7e" % arr
-                mdf_file.append(line + '\n')
-
-            elif type(content) == list:
-                # multiple-line character parameter
-                mdf_file.append("%-6s = #%s#\n" % (key, content[0]))
-                for line in content[1:]:
-                    mdf_file.append("         #%s#\n" % line)
-
-            else:
-                if type(content) == float:
-                    # single number parameter
-                    formatter = "%-6s = %d" if key in int_key else "%-6s = %.7e"
-                    line = formatter % (key, content)
-                elif type(content) == str and '[' not in content:
-                    # single character parameter 1
-                    line = "%-6s = #%s#" % (key, content)
-                elif type(content) == str and '[' in content:
-                    # single character parameter 2
-                    line = "%-6s = %s" % (key, content)
-                else:
-                    raise ValueError("invalid key")
-                mdf_file.append(line + '\n')
+            # pick the formatter by the type of the parameter
+            formatter = _FORMATTERS.get(type(content))
+            if formatter is None:
+                raise ValueError("invalid key")
+            mdf_file += formatter(key, content)
 
         return mdf_file
 
@@ -1,11 +1,28 @@
 import os
+import subprocess
+from functools import lru_cache
 from pathlib import Path
 import xml.dom.minidom
+from xml.sax.saxutils import escape
 import numpy as np
-from multiprocessing import Pool
+import multiprocessing
 from delft3d import MdfFile
 import time
 
+# only the mdf and url file of the xml template are changed for each run
+_MDF_PLACEHOLDER = '<mdfFile>river.mdf</mdfFile>'
+_URL_PLACEHOLDER = '<urlFile>river.url</urlFile>'
+
+
+@lru_cache(maxsize=1)
+def _xml_template():
+    """Template of the xml file for d_hydro.exe, parsed once on first use"""
+    template = xml.dom.minidom.parse(os.path.join(os.path.dirname(__file__), 'config_d_hydro.xml')).toxml()
+    for placeholder in (_MDF_PLACEHOLDER, _URL_PLACEHOLDER):
+        if placeholder not in template:
+            raise ValueError("%s is not found in config_d_hydro.xml" % placeholder)
+    return template
+
 
 class Simulation(object):
     def __init__(self, delft3d_path):
@@ -79,14 +96,24 @@ class Simulation(object):
         """
         if result is None:
             result = {}
+        # depth-first search with an explicit stack of directory iterators instead of recursion.
+        # os.scandir gets the type of each entry from the directory listing, without extra stat calls
         root = Path(root)
-        for path in root.iterdir():
-            if len(result) == len(target):
-                return result
-            elif '/'.join(path.parts[-2:]) in target:
-                result['/'.join(path.parts[-2:])] = path
-            elif path.is_dir():
-                self.recursive_search(path, target, result)
+        stack = [(root.name, os.scandir(root))]
+        try:
+            while stack and len(result) < len(target):
+                parent, entries = stack[-1]
+                entry = next(entries, None)
+                if entry is None:
+                    # finish searching this directory
+                    stack.pop()[1].close()
+                elif parent + '/' + entry.name in target:
+                    result[parent + '/' + entry.name] = Path(entry.path)
+                elif entry.is_dir():
+                    stack.append((entry.name, os.scandir(entry.path)))
+        finally:
+            for _, entries in stack:
+                entries.close()
         if len(result) == len(target):
             return result
 
@@ -138,12 +165,15 @@ class Simulation(object):
                 # run in parallel
                 print("-------------------Parallelization------------------")
                 if workers == -1:
-                    pool = Pool()
-                elif workers > 1:
-                    pool = Pool(workers)
-                else:
+                    workers = os.cpu_count()
+                elif workers < 1:
                     raise ValueError('invalid workers number')
-                pool.map(_run, mdf_file)
+                # spawn is how Windows starts the workers anyway, use it on every platform.
+                # Hand out one simulation at a time, so that a free worker picks the next one
+                # right away when the simulations take different time
+                with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                    for _ in pool.imap_unordered(_run, mdf_file, chunksize=1):
+                        pass
             # report
             end = time.time()  # end time
             time_usage = end - start
@@ -171,18 +201,17 @@ class Simulation(object):
             self.output_nc(mdf_file)
         # create xml
         self.create_xml(mdf_file, run_id)
-        # create bat
-        self.create_bat(mdf_file, run_id, disp=disp)
-        # execute simulation
-        switch_cwd = "cd %s" % mdf_file.parents[0]
-        run = "run_%d.bat" % run_id
-        command = " && ".join([switch_cwd, run])
-        status = os.system(command)
+        # execute simulation. Call d_hydro.exe directly with the Delft3D binaries on the PATH,
+        # instead of going through cmd.exe and a bat file
+        env = dict(os.environ, PATH=os.pathsep.join([str(self.engine['dflow2d3d']),
+                                                     str(self.engine['share'])]))
+        command = [str(self.engine['d_hydro']), 'config_d_hydro_%d.xml' % run_id]
+        status = subprocess.run(command, cwd=mdf_file.parents[0], env=env,
+                                stdout=None if disp else subprocess.DEVNULL).returncode
         if status != 0:
             raise RuntimeError("Simulation failed")
-        # remove xml file and bat file
+        # remove xml file
         os.remove(mdf_file.parents[0] / ('config_d_hydro_%d.xml' % run_id))
-        os.remove(mdf_file.parents[0] / ("run_%d.bat" % run_id))
         # restore mdf file
         if netcdf:
             mdf = MdfFile(mdf_file)
@@ -197,22 +226,22 @@ class Simulation(object):
     def create_xml(mdf_file, run_id):
         """Create xml file for d_hydro.exe"""
         mdf_file = Path(mdf_file).absolute()
-        # get xml template path
-        module_path = Path(os.path.dirname(__file__))
-        xml_path = module_path / 'config_d_hydro.xml'
         # edit xml
-        delft3d_xml = xml.dom.minidom.parse("%s" % xml_path)
-        mdfFile = delft3d_xml.getElementsByTagName('mdfFile')[0]
-        mdfFile.childNodes[0].data = mdf_file.name
-        urlFile = delft3d_xml.getElementsByTagName('urlFile')[0]
-        urlFile.childNodes[0].data = mdf_file.name.replace('.mdf', '.url')
+        delft3d_xml = _xml_template().replace(
+            _MDF_PLACEHOLDER, '<mdfFile>%s</mdfFile>' % escape(mdf_file.name))
+        url_file = mdf_file.name.replace('.mdf', '.url')
+        delft3d_xml = delft3d_xml.replace(
+            _URL_PLACEHOLDER, '<urlFile>%s</urlFile>' % escape(url_file))
         # write xml
         project_xml_path = mdf_file.parents[0] / ('config_d_hydro_%d.xml' % run_id)
         with project_xml_path.open('w') as f:
-            delft3d_xml.writexml(f)
+            f.write(delft3d_xml)
 
     def create_bat(self, mdf_file, run_id, disp=True):
-        """Create bat file to call d_hydro.exe to execute simulation"""
+        """
+        Create bat file to call d_hydro.exe to execute simulation, e.g. to run it by hand.
+        self.sim_unit calls d_hydro.exe directly and does not need it.
+        """
         mdf_file = Path(mdf_file).absolute()
         # create command
         echo_off = "@echo off"
@@ -1,8 +1,88 @@
+import copy
+import locale
 import os
 import re
+import string
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 
+from delft3d.GrdFile import _fromstring
+
+# name and value of a header, e.g. "reference-time       20200331"
+_HEADER_RE = re.compile(r"^([^-][\w-]+)\s+('?[\w\d (),./:-]+'?)")
+# unit of a parameter header, including the leading whitespace
+_UNIT_RE = re.compile(r"([\s]+unit '\[[\w/]+\]')")
+# value of a header without quotation marks
+_VALUE_RE = re.compile(r'[\w() /:,.-]+\b\)?')
+# unit without the brackets
+_UNIT_NAME_RE = re.compile(r"unit '\[([\w/]+)\]'")
+# characters allowed in the name and the value of a header, the ASCII part of _HEADER_RE
+_NAME_CHARS = frozenset(string.ascii_letters + string.digits + '_-')
+_VALUE_CHARS = frozenset(string.ascii_letters + string.digits + '_ (),./:-')
+
+
+def _split_header(line):
+    """
+    Split a header line into its name and value, e.g. "reference-time       20200331".
+    Well-formed lines are split with plain string operations, anything else falls back
+    to _HEADER_RE. Return None if the line is not a header (end of the header).
+    """
+    name, sep, value = line.partition(' ')
+    value = value.lstrip(' ').rstrip('\n')
+    if value[:1] == "'":
+        # string value ends at the closing quotation mark
+        value = value[:value.find("'", 1) + 1]
+        inner = value[1:-1]
+    else:
+        inner = value
+    if (sep and len(name) > 1 and name[0] != '-' and _NAME_CHARS.issuperset(name) and
+            inner and _VALUE_CHARS.issuperset(inner)):
+        return name, value
+    matches = _HEADER_RE.search(line)
+    return (matches[1], matches[2]) if matches else None
+
+
+@lru_cache(maxsize=None)
+def _pad_name(name):
+    """Header name padded to the width of the name column. The same few names repeat in every table"""
+    return name.ljust(21)
+
+
+@lru_cache(maxsize=32)
+def _to_timestamp(reference_time):
+    """
+    Parse the reference time. The tables of a file usually share the same reference time,
+    so the Timestamp is parsed once and reused
+    """
+    return pd.to_datetime(reference_time)
+
+
+@lru_cache(maxsize=8)
+def _load_tables(filename, mtime, size):
+    """
+    Read the time series of bct/bcc/dis file. Cached by filename, modification time and size
+    to avoid parsing the same file again
+    """
+    # read and decode the whole file at once, with the same encoding and newline translation as text mode
+    with open(filename, 'rb') as f:
+        text = f.read().decode(locale.getpreferredencoding(False))
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    # the line of each 'table-name' starts a new time series
+    starts = []
+    index = text.find('table-name')
+    while index != -1:
+        starts.append(text.rfind('\n', 0, index) + 1)
+        line_end = text.find('\n', index)
+        index = text.find('table-name', line_end) if line_end != -1 else -1
+    if not starts:
+        return []
+    starts[0] = 0  # lines before the first table-name belong to the first time series
+    ends = starts[1:] + [len(text)]
+    # interpret each time series
+    return [TimeSeries(text[start:end].splitlines(keepends=True)) for start, end in zip(starts, ends)]
+
 
 class TimeSeriesFile(object):
     """
@@ -22,25 +102,10 @@ class TimeSeriesFile(object):
 
     def load_file(self):
         """Read bct/bcc/dis file. The content of the file will be stored in self.data. """
-        with open(self.filename) as f:
-            data = f.readlines()
-        # read each time series and interpret them
-        time_series = []
-        start_index, end_index = 0, None
-        in_table = False
-        for index, line in enumerate(data):
-            if in_table and index == len(data) - 1:
-                # last time series
-                time_series.append(TimeSeries(data[start_index:]))
-            elif 'table-name' in line:
-                end_index = index
-                if in_table:
-                    # interpret time series
-                    time_series.append(TimeSeries(data[start_index: end_index]))
-                    start_index = index
-                else:
-                    in_table = True
-        return time_series
+        # the cached tables are shared, so work on a copy of them
+        tables = _load_tables(os.path.abspath(self.filename), os.path.getmtime(self.filename),
+                              os.path.getsize(self.filename))
+        return copy.deepcopy(tables)
 
     def set_header(self, num, data, unit=False):
         """
@@ -126,10 +191,13 @@ class TimeSeriesFile(object):
             ...]
 
         """
-        bct_data = []
+        return list(self._iter_lines())
+
+    def _iter_lines(self):
+        """Generate the lines of Delft3D time series file. Used by self.export and self.to_file"""
         for time_series in self.data:
-            bct_data += time_series.export()
-        return bct_data
+            yield from time_series.export_header()
+            yield from time_series.export_time_series()
 
     def to_file(self, filename):
         """
@@ -146,44 +214,68 @@ class TimeSeriesFile(object):
         >>> bct = delft3d.TimeSeriesFile('example/example1.bct')
         >>> bct.to_file('example1.bct')
         """
-        bct_data = self.export()
-        with open(filename, 'w') as f:
-            for line in bct_data:
-                f.write(line)
+        # write through a large buffer, the lines are short and there are many of them
+        with open(filename, 'w', buffering=1 << 20) as f:
+            f.writelines(self._iter_lines())
 
 
 class TimeSeries(object):
     """Read, modify and export Delft3D time series."""
     def __init__(self, time_series: list):
-        self.time_series = None
+        # the records are kept as a float array, the DataFrame is only built when it is used.
+        # See self.time_series
+        self._records = None
+        self._reference_time = None  # reference time of the records
+        self._colname = None  # column names of the records
+        self._time_series = None
+        self._body_start = None  # index of the first record, found by self.load_header
         self.header = None
         self.load_header(time_series)
         self.load_time_series(time_series)
 
+    @property
+    def time_series(self):
+        """Time series as a DataFrame indexed by the absolute time, built on first access"""
+        if self._time_series is None and self._records is not None:
+            relative_time, parm1, parm2 = self._records[:, 0], self._records[:, 1], self._records[:, 2]
+            time = _to_timestamp(self._reference_time) + pd.to_timedelta(relative_time, unit="minutes")
+            colname = self._colname
+            self._time_series = pd.DataFrame(
+                {colname[0]: relative_time, colname[1]: parm1, colname[2]: parm2}, index=time)
+        return self._time_series
+
+    @time_series.setter
+    def time_series(self, time_series):
+        # the DataFrame replaces the records
+        self._time_series = time_series
+        self._records = None
+
     def load_header(self, time_series: list):
         """Read and interpret the header of a time series."""
         header_dict = {}
         parameter = {}
         records_in_table = None
-        header_re = re.compile(r"^([^-][\w-]+)\s+('?[\w\d (),./:-]+'?)")
-        unit_re = re.compile(r"([\s]+unit '\[[\w/]+\]')")
-        for line in time_series:
-            matches = header_re.search(line)  # search for header
+        self._body_start = None
+        for index, line in enumerate(time_series):
+            matches = _split_header(line)  # search for header
             if matches:
-                if matches[1] == 'parameter':
+                name, value = matches
+                if name == 'parameter':
                     # parameters have the same header name. So store all parameters
                     # in one dict
-                    unit_match = unit_re.search(line)  # search for unit
-                    key_name = matches[2].strip('\'')  # reformat unit
+                    unit_match = _UNIT_RE.search(line)  # search for unit
+                    key_name = value.strip('\'')  # reformat unit
                     key_name = key_name.strip(' ')
-                    parameter[key_name] = Parameter(matches[2], unit_match[1])
-                elif matches[1] == 'records-in-table':
+                    parameter[key_name] = Parameter(value, unit_match[1])
+                elif name == 'records-in-table':
                     # records-in-table should be the last header. Store it hera and
                     # then put it at the end of headers by the end.
-                    records_in_table = Parameter(matches[2])
+                    records_in_table = Parameter(value)
+                    # the records follow this header, remember it for self.load_time_series
+                    self._body_start = index + 1
                 else:
                     # regular header
-                    header_dict[matches[1]] = Parameter(matches[2])
+                    header_dict[name] = Parameter(value)
             else:  # end of the header
                 header_dict['parameter'] = parameter
                 header_dict['records-in-table'] = records_in_table
@@ -192,27 +284,25 @@ class TimeSeries(object):
 
     def load_time_series(self, time_series: list):
         """Read and interpret time series"""
-        is_header = True  # whether the pointer at the header
-        reference_time = pd.to_datetime(self.header['reference-time'].value)
-        # read the time series data
-        time, relative_time, parm1, parm2 = [], [], [], []
-        for line in time_series:
-            if not is_header:
-                # prepossess
-                data = [float(i) for i in line.split()]
-                time.append(reference_time + pd.to_timedelta(data[0], unit="minutes"))
-                # store the data
-                relative_time.append(data[0])
-                parm1.append(data[1])
-                parm2.append(data[2])
-            if 'records-in-table' in line:
-                is_header = False
-        else:
-            # converts lists to DataFrame
-            colname = list(self.header['parameter'].keys())
-            time_series = pd.DataFrame(
-                {colname[0]: relative_time, colname[1]: parm1, colname[2]: parm2}, index=time)
-        self.time_series = time_series
+        # the time series data starts after the 'records-in-table' header. It is found while
+        # reading the header, so only search for it if the header does not have it
+        start = self._body_start
+        if start is None:
+            start = next((index + 1 for index, line in enumerate(time_series)
+                          if 'records-in-table' in line), len(time_series))
+        lines = time_series[start:]
+        # parse all numbers at once with numpy's C parser, each line is a record
+        ncol = len(lines[0].split()) if lines else 3
+        data = _fromstring(''.join(lines))
+        if data.size != len(lines) * ncol:
+            # a record has a different length, or the file is truncated
+            raise ValueError("Found %d values, but %d records of %d values are required by the table"
+                             % (data.size, len(lines), ncol))
+        # store the records, the DataFrame is built from them when self.time_series is used
+        self._records = data.reshape(-1, ncol)[:, :3]
+        self._reference_time = self.header['reference-time'].value
+        self._colname = list(self.header['parameter'].keys())
+        self._time_series = None
 
     def set_header(self, data: dict, unit=False) -> None:
         """Set new content of header. Called by TimeSeriesFile.set_header()"""
@@ -238,14 +328,14 @@ class TimeSeries(object):
         """
         time_series = pd.concat([data1, data2], axis=1)
         # calculate the absolute time and  relative time
-        reference_time = pd.to_datetime(reference_time)
+        reference_time = _to_timestamp(reference_time)
         relative_time = time_series.index - reference_time
-        relative_time = [time.total_seconds() / 60 for time in relative_time]  # 单位：minute
+        relative_time = relative_time.total_seconds().to_numpy() / 60  # 单位：minute
         relative_time = pd.Series(relative_time, index=time_series.index, name='time')
         # combine time absolute time, relative time and data
         time_series = pd.concat([relative_time, time_series], axis=1)
         # store new time series
-        self.time_series = time_series.copy()
+        self.time_series = time_series  # concat already gives a new DataFrame
         # change the 'reference time' and 'records-in-table' in the header
         reference_time = reference_time.strftime("%Y%m%d")
         self.set_header({'records-in-table': len(time_series), "reference-time": reference_time})
@@ -257,22 +347,26 @@ class TimeSeries(object):
 
             if key != 'parameter':
                 # parameter header
-                head = key.ljust(21) + parm.export() + '\n'
+                head = _pad_name(key) + parm.export() + '\n'
                 header.append(head)
             else:
                 # regular header
                 for i in parm:
-                    head = key.ljust(21) + parm[i].export() + '\n'
+                    head = _pad_name(key) + parm[i].export() + '\n'
                     header.append(head)
         return header
 
     def export_time_series(self):
         """Export the time series as a list in the format of Delft3D time series files"""
-        time_series = []
-        for index, row in self.time_series.iterrows():
-            time_series.append(" {:.7e} {:.7e} {:.7e}\n".format(row[0], row[1], row[2]))
-            pass
-        return time_series
+        if self._time_series is None:
+            # the records have not been turned into a DataFrame, format them directly
+            values = self._records
+        else:
+            # take the three columns as one float array instead of iterating rows of the DataFrame
+            values = self._time_series.iloc[:, :3].to_numpy(dtype=np.float64)
+        # format all records with a single % operation, then split them into lines
+        text = (" %.7e %.7e %.7e\n" * len(values)) % tuple(values.ravel().tolist())
+        return text.splitlines(keepends=True)
 
     def export(self):
         """Export all data as a list in the format of Delft3D time series files"""
@@ -286,8 +380,8 @@ class Parameter(object):
     """
     def __init__(self, value, unit=None):
         """Read the store the format, type and unit of a header"""
-        value_re = re.compile(r'[\w() /:,.-]+\b\)?')  # search for the value
-        value_match = value_re.search(value)
+        self._content = None  # exported content and the attributes it was made from
+        value_match = _VALUE_RE.search(value)  # search for the value
         self.value = value_match[0]
         if '\'' in value:
             # string type
@@ -299,25 +393,28 @@ class Parameter(object):
             self.type = 'num'
 
         self.unit = None
+        self.unit_length = None
         # store the unit
         if unit:
             # search for unit
-            unit_re = re.compile(r"unit '\[([\w/]+)\]'")
-            unit_match = unit_re.search(unit)
+            unit_match = _UNIT_NAME_RE.search(unit)
             # store the unit
             self.unit = unit_match[1]
             self.unit_length = len(unit)
 
     def export(self):
         """export the header in its original format"""
-        if self.type == 'str':
-            content = "'{}'".format(self.value.ljust(self.value_length))
-            if self.unit:
-                content += ("unit '[{}]'".format(self.unit)).rjust(self.unit_length)
-        else:
-            content = "{}".format(self.value.ljust(self.value_length))
-
-        return content
+        # reuse the last content as long as nothing it depends on has changed
+        key = (self.value, self.unit, self.value_length, self.unit_length, self.type)
+        if self._content is None or self._content[0] != key:
+            if self.type == 'str':
+                content = "'{}'".format(self.value.ljust(self.value_length))
+                if self.unit:
+                    content += ("unit '[{}]'".format(self.unit)).rjust(self.unit_length)
+            else:
+                content = "{}".format(self.value.ljust(self.value_length))
+            self._content = (key, content)
+        return self._content[1]
 
     def __repr__(self):
         if self.unit:
@@ -1,5 +1,9 @@
+import os
+import tempfile
 from unittest import TestCase, main
 import delft3d
+import matplotlib
+import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
@@ -24,6 +28,15 @@ class TestTimeSeriesFile(TestCase):
         dis_data = delft3d.TimeSeriesFile("dis_test.dis")
         self.assertListEqual(dis_test, dis_data.export())
 
+    def test_reopen_file(self):
+        # the file is parsed once, but each TimeSeriesFile works on its own copy
+        bct_data = delft3d.TimeSeriesFile("bct_test.bct")
+        bct_data.set_header(0, {'location': '(1,1)..(1,1)'})
+        bct_data.data[0].time_series.iloc[0, 1] = -1.0
+        with open("bct_test.bct", 'r') as f:
+            bct_test = f.readlines()
+        self.assertListEqual(bct_test, delft3d.TimeSeriesFile("bct_test.bct").export())
+
     def test_set_header(self):
         bct_data = delft3d.TimeSeriesFile("bct_test.bct")
         bct_data.set_header(0, {'location': '(1,1)..(1,1)'})
@@ -40,6 +53,23 @@ class TestTimeSeriesFile(TestCase):
         self.assertEqual(bct_data.data[0].header['parameter']['time'].export(),
                          "'relative time       '                    unit '[hour]'")
 
+    def test_set_header_attributes(self):
+        # the exported content follows every attribute of the header
+        bct_data = delft3d.TimeSeriesFile("bct_test.bct")
+        bct_data.set_header(0, {'location': '(1,1)..(1,1)'})
+        bct_data.set_header(0, {'parameter': {'time': 'relative time'}})
+        bct_data.set_header(0, {'parameter': {'time': 'hour'}}, unit=True)
+        location = bct_data.data[0].header['location']
+        self.assertEqual(location.export(), "'(1,1)..(1,1)        '")
+        location.value_length = 14
+        self.assertEqual(location.export(), "'(1,1)..(1,1)  '")
+        time = bct_data.data[0].header['parameter']['time']
+        time.unit_length = 14
+        self.assertEqual(time.export(), "'relative time       ' unit '[hour]'")
+        records = bct_data.data[0].header['records-in-table']
+        records.type = 'str'
+        self.assertEqual(records.export(), "'%s'" % records.value.ljust(records.value_length))
+
     def test_set_time_series(self):
 
         reference_time = pd.to_datetime("2020-04-15")
@@ -75,6 +105,13 @@ class TestTimeSeriesFile(TestCase):
         self.assertTrue((mdf.data['Rettis'] == np.array([[1], [1]])).all())
         self.assertEqual(mdf.data['FlNcdf'], 'map his dro fou')
 
+    def test_MdfFile_load_many(self):
+        filenames = ['mdf_test.mdf', 'dflow1/f34.mdf', 'dflow2/f34.mdf']
+        mdfs = delft3d.MdfFile.load_many(filenames)
+        self.assertListEqual([mdf.filename for mdf in mdfs], filenames)
+        for mdf, filename in zip(mdfs, filenames):
+            self.assertListEqual(mdf.export(), delft3d.MdfFile(filename).export())
+
     def test_GrdFile_export(self):
         grd1 = delft3d.GrdFile('grd_test1.grd').export()
         grd2 = delft3d.GrdFile('grd_test2.grd').export()
@@ -85,6 +122,21 @@ class TestTimeSeriesFile(TestCase):
         self.assertEqual(''.join(grd1), ''.join(test_grd1))
         self.assertEqual(''.join(grd2), ''.join(test_grd2))
 
+    def test_GrdFile_crlf(self):
+        # files written on Windows end their lines with CRLF
+        with tempfile.TemporaryDirectory() as tmp:
+            with open('grd_test1.grd', 'rb') as f:
+                text = f.read().replace(b'\n', b'\r\n')
+            grd_file = os.path.join(tmp, 'grd_test1.grd')
+            with open(grd_file, 'wb') as f:
+                f.write(text)
+            grd1, grd1_crlf = delft3d.GrdFile('grd_test1.grd'), delft3d.GrdFile(grd_file)
+            self.assertEqual(grd1_crlf.header, grd1.header)
+            self.assertTrue((grd1_crlf.x == grd1.x).all())
+            self.assertTrue((grd1_crlf.y == grd1.y).all())
+            dep1 = delft3d.DepFile('dep_test1.dep', grd_file)
+            self.assertTrue((dep1.data == delft3d.DepFile('dep_test1.dep', 'grd_test1.grd').data).all())
+
     def test_GrdFile_coordinates(self):
         grd1 = delft3d.GrdFile('grd_test1.grd')
         grd1_sphX = np.loadtxt('grd_test1_sphX.txt')
@@ -99,12 +151,51 @@ class TestTimeSeriesFile(TestCase):
         self.assertTrue((grd1.x - grd1_carX < 1e-8).all())
         self.assertTrue((grd1.y - grd1_carY < 1e-8).all())
 
+    def test_GrdFile_axis_order(self):
+        # x is the longitude and y is the latitude of a spherical grid,
+        # compare with the closed form of Web Mercator (EPSG:3857)
+        grd1 = delft3d.GrdFile('grd_test1.grd')
+        x, y = grd1.x[5, 5], grd1.y[5, 5]
+        radius = 6378137.0
+        grd1.cartesian_to_spherical()
+        self.assertAlmostEqual(grd1.x[5, 5], np.degrees(x / radius), places=8)
+        latitude = np.degrees(2 * np.arctan(np.exp(y / radius)) - np.pi / 2)
+        self.assertAlmostEqual(grd1.y[5, 5], latitude, places=8)
+
     def test_GrdFile_get_nearest_grid(self):
         grd1 = delft3d.GrdFile('grd_test1.grd')
         m, n = grd1.get_nearest_grid(grd1.x[5, 4], grd1.y[5, 4])
         self.assertEqual(m, 4)
         self.assertEqual(n, 5)
 
+    def test_GrdFile_get_nearest_grid_batch(self):
+        grd1 = delft3d.GrdFile('grd_test1.grd')
+        x, y = grd1.x[[5, 10, 15], [4, 6, 8]], grd1.y[[5, 10, 15], [4, 6, 8]]
+        scalar = [grd1.get_nearest_grid(i, j) for i, j in zip(x, y)]
+        # 1-D input
+        m, n = grd1.get_nearest_grid(x, y)
+        self.assertListEqual(list(zip(m, n)), scalar)
+        # 2-D input keeps the shape
+        m, n = grd1.get_nearest_grid(np.tile(x, (2, 1)), np.tile(y, (2, 1)))
+        self.assertEqual(m.shape, (2, 3))
+        self.assertListEqual(list(zip(m[1], n[1])), scalar)
+        # empty input
+        m, n = grd1.get_nearest_grid([], [])
+        self.assertEqual(m.size, 0)
+        self.assertEqual(n.size, 0)
+        # x and y of different shape
+        with self.assertRaisesRegex(ValueError, 'same shape'):
+            grd1.get_nearest_grid(x[0], y)
+        with self.assertRaisesRegex(ValueError, 'same shape'):
+            grd1.get_nearest_grid([1, 2], [3])
+
+    def test_GrdFile_load_many(self):
+        filenames = ['grd_test2.grd', 'grd_test1.grd']
+        grds = delft3d.GrdFile.load_many(filenames, workers=2)
+        self.assertListEqual([grd.filename for grd in grds], filenames)
+        for grd, filename in zip(grds, filenames):
+            self.assertListEqual(grd.export(), delft3d.GrdFile(filename).export())
+
     def test_DepFile(self):
         dep_data1 = delft3d.DepFile('dep_test1.dep', 'grd_test1.grd').export()
         dep_data2 = delft3d.DepFile('dep_test2.dep', 'grd_test2.grd').export()
@@ -116,6 +207,84 @@ class TestTimeSeriesFile(TestCase):
         self.assertListEqual(dep_data1, dep_file1)
         self.assertListEqual(dep_data2, dep_file2)
 
+    def test_DepFile_reopen_grd(self):
+        # the grid is parsed once, but each DepFile works on its own copy
+        dep1 = delft3d.DepFile('dep_test1.dep', 'grd_test1.grd')
+        dep1.grd_file.x[0, 0] = -1.0
+        dep1.grd_file.header['MN'][0] = -1
+        dep2 = delft3d.DepFile('dep_test1.dep', 'grd_test1.grd')
+        self.assertNotEqual(dep2.grd_file.x[0, 0], -1.0)
+        self.assertNotEqual(dep2.grd_file.header['MN'][0], -1)
+        self.assertListEqual(dep2.grd_file.export(), delft3d.GrdFile('grd_test1.grd').export())
+
+    def test_DepFile_dtype(self):
+        dep32 = delft3d.DepFile('dep_test1.dep', 'grd_test1.grd', dtype=np.float32)
+        dep64 = delft3d.DepFile('dep_test1.dep', 'grd_test1.grd')
+        self.assertEqual(dep32.data.dtype, np.float32)
+        self.assertEqual(dep64.data.dtype, np.float64)
+        # the last digit may differ, but the lines are laid out the same way
+        dep_data32, dep_data64 = dep32.export(), dep64.export()
+        self.assertListEqual([len(line) for line in dep_data32], [len(line) for line in dep_data64])
+        self.assertListEqual([len(line.split()) for line in dep_data32],
+                             [len(line.split()) for line in dep_data64])
+        values32 = np.array(''.join(dep_data32).split(), dtype=np.float64)
+        values64 = np.array(''.join(dep_data64).split(), dtype=np.float64)
+        self.assertTrue(np.allclose(values32, values64, rtol=1e-6))
+
+    def test_DepFile_plot(self):
+        matplotlib.use('Agg')
+        grd = delft3d.GrdFile('grd_test1.grd')
+        dep = delft3d.DepFile('dep_test1.dep', grd)
+        n, m = grd.x.shape
+        # regular 10 m grid at projected coordinates, x decreases along the rows
+        x, y = np.meshgrid(5e5 - np.arange(m) * 10.0, 2.5e6 + np.arange(n) * 10.0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            grd.set_gird(x, y, 'Cartesian')
+            dep.plot(os.path.join(tmp_dir, 'rectilinear.png'))
+            ax = plt.gcf().axes[0]
+            self.assertEqual(len(ax.images), 1)
+            self.assertListEqual(list(ax.images[0].get_extent()), [x.min(), x.max(), y.min(), y.max()])
+            # the image runs from west to east, so the columns are flipped
+            image = ax.images[0].get_array()
+            depth = np.ma.masked_equal(dep.data[:-1, :-1], -999)
+            self.assertTrue(np.ma.allequal(image, depth[:, ::-1]))
+            self.assertListEqual(image.mask.tolist(), depth.mask[:, ::-1].tolist())
+            plt.close('all')
+            # the same grid rotated by 0.85 degree must be drawn cell by cell
+            angle = np.deg2rad(0.85)
+            x0, y0 = x - 5e5, y - 2.5e6
+            grd.set_gird(5e5 + x0 * np.cos(angle) - y0 * np.sin(angle),
+                         2.5e6 + x0 * np.sin(angle) + y0 * np.cos(angle), 'Cartesian')
+            dep.plot(os.path.join(tmp_dir, 'rotated.png'))
+            ax = plt.gcf().axes[0]
+            self.assertEqual(len(ax.images), 0)
+            self.assertEqual(len(ax.collections), 1)
+            plt.close('all')
+
+    def test_truncated_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            def truncated(filename, n_lines, replace=None):
+                # copy the first n_lines of a test file, optionally breaking one number
+                with open(filename, 'r') as f:
+                    text = ''.join(f.readlines()[:n_lines])
+                if replace:
+                    text = text.replace(*replace)
+                path = os.path.join(tmp, filename)
+                with open(path, 'w') as f:
+                    f.write(text)
+                return path
+
+            count_error = r'Found \d+ values, but \d+ values are required by the grid'
+            with self.assertRaisesRegex(ValueError, count_error):
+                delft3d.GrdFile(truncated('grd_test1.grd', 20))
+            with self.assertRaisesRegex(ValueError, 'No grid coordinates found'):
+                delft3d.GrdFile(truncated('grd_test1.grd', 3))
+            with self.assertRaisesRegex(ValueError, count_error):
+                delft3d.DepFile(truncated('dep_test1.dep', 20), 'grd_test1.grd')
+            bct_file = truncated('bct_test.bct', 1000, ('4.2820000e-01 4', '4.28x0000e-01 4'))
+            with self.assertRaisesRegex(ValueError, "Found invalid value '4.28x0000e-01' after 4 values"):
+                delft3d.TimeSeriesFile(bct_file)
+
 
 if __name__ == '__main__':
     main()